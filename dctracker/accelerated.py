@@ -0,0 +1,113 @@
+"""
+Copyright (C) 2023-2024 Samuel Prince <samuel.prince-drouin@umontreal.ca>
+
+This file is a part of CoPixie.
+
+This file may be used under the terms of the GNU General Public License
+version 3 as published by the Free Software Foundation and appearing in
+the file LICENSE included in the packaging of this file.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Numba is optional. When it is not installed, the kernels are executed as plain
+# Python functions (same results, but slower) or replaced by a vectorized pandas version
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Replacement for numba.njit that returns the function unchanged"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def keep_mask(frames, ids):
+    """
+    Returns a boolean mask of the rows to keep in the colocalisation matrix. Rows where every
+    particle is present are always kept, while rows with a missing particle are only kept if
+    one of their particle ID is not present elsewhere in the frame.
+
+    The rows must be grouped by frame (i.e., the matrix is sorted by frame).
+
+    Arguments:
+        frames (ndarray): Frame of each row (int64)
+        ids (ndarray): Particle IDs with a row per matrix row and a column per particle (int64).
+            Missing particles are encoded as -1.
+
+    Return:
+        ndarray: Boolean mask of the rows to keep
+    """
+    n_rows, n_cols = ids.shape
+    keep = np.zeros(n_rows, dtype=np.bool_)
+
+    start = 0
+    while start < n_rows:
+        # Find the rows of the current frame
+        end = start + 1
+        while end < n_rows and frames[end] == frames[start]:
+            end += 1
+
+        # Keep the rows without missing particles
+        for i in range(start, end):
+            complete = True
+            for j in range(n_cols):
+                if ids[i, j] < 0:
+                    complete = False
+                    break
+            keep[i] = complete
+
+        # Count the occurrences of each ID in a single pass, then keep the rows
+        # that contains an ID found only once in the frame
+        for j in range(n_cols):
+            counts = dict()
+            for i in range(start, end):
+                if ids[i, j] >= 0:
+                    if ids[i, j] in counts:
+                        counts[ids[i, j]] += 1
+                    else:
+                        counts[ids[i, j]] = 1
+            for i in range(start, end):
+                if ids[i, j] >= 0 and counts[ids[i, j]] == 1:
+                    keep[i] = True
+
+        start = end
+
+    return keep
+
+
+def keep_mask_pandas(frames, ids):
+    """
+    Vectorized pandas version of keep_mask used when Numba is not available. The occurrences
+    of each ID in its frame are counted with a single groupby per particle instead of a Python
+    loop over the frames. The rows do not need to be grouped by frame.
+
+    Arguments:
+        frames (ndarray): Frame of each row (int64)
+        ids (ndarray): Particle IDs with a row per matrix row and a column per particle (int64).
+            Missing particles are encoded as -1.
+
+    Return:
+        ndarray: Boolean mask of the rows to keep
+    """
+    present = ids >= 0
+    unique_masks = [present.all(axis=1)]
+    for j in range(ids.shape[1]):
+        column = pd.DataFrame({'FRAME': frames, 'ID': ids[:, j]})
+        counts = column.groupby(['FRAME', 'ID'])['ID'].transform('size').to_numpy()
+        unique_masks.append(present[:, j] & (counts == 1))
+
+    return np.logical_or.reduce(unique_masks)
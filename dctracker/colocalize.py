@@ -18,6 +18,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
 import pathlib
+import numpy as np
 import pandas
 
 
@@ -41,21 +42,24 @@ class Colocalize:
             particle_names.append(particle["Name"])
         
         # Parse the colocalisation and generate the simplified colocalisation table
-        interactions = []
-        # Initial grouping with same particle ID 
-        for k, g in dctracker.groupby(by = particle_names, dropna=False):   
-            # Split the group when the frame are non-consecutive
-            for _, sg in g.groupby(g["FRAME"].diff().gt(1).cumsum()):
-                start_frame = int(sg.iloc[0]["FRAME"])
-                end_frame = int(sg.iloc[-1]["FRAME"])
-                length = end_frame-start_frame
-                interactions.append(list(k) + [str(start_frame), str(end_frame)])
-        colocalisation = pandas.DataFrame(interactions)
-        colocalisation.columns = particle_names + ["Start.Frame", "End.Frame"]
-
-        # Change the particle ID type to Int64 (to accept NaN) to simplify the output
+        # Rows with the same particle IDs are made contiguous (in frame order) and a run starts
+        # when the particle IDs change or when the frames are non-consecutive
+        dctracker = dctracker.sort_values(by = particle_names + ["FRAME"], kind='stable', na_position='last')
+        ids = dctracker[particle_names].fillna(-1).to_numpy()
+        frames = dctracker["FRAME"].to_numpy()
+
+        new_run = np.ones(len(dctracker), dtype=bool)
+        new_run[1:] = (ids[1:] != ids[:-1]).any(axis=1) | (np.diff(frames) > 1)
+        starts = np.flatnonzero(new_run)
+        ends = np.append(starts[1:], len(dctracker)) - 1
+
+        colocalisation = dctracker[particle_names].iloc[starts].reset_index(drop=True)
+        colocalisation["Start.Frame"] = frames[starts].astype(int)
+        colocalisation["End.Frame"] = frames[ends].astype(int)
+
+        # Change the particle ID type to Int32 (to accept NaN, IDs and frames fit in 32 bits) to simplify the output
         for col in particle_names:
-            colocalisation[col] = colocalisation[col].astype('Int64')
+            colocalisation[col] = colocalisation[col].astype('Int32')
         
         # Write the output
         full_output_file_path = pathlib.Path(self.description['Output'], 'Colocalize.csv')
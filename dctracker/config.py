@@ -37,6 +37,11 @@ FrameInterval = float
 """
 
 
+# The configuration spec and the validator are immutable, they are parsed and created once 
+SPEC = ConfigObj(io.StringIO(CONFIG_SPECS), list_values=False, _inspec=True)
+VALIDATOR = Validator()
+
+
 class ConfigError(RuntimeError):
     """Raise if a configuration file contains one or more invalid options """
 
@@ -70,17 +75,17 @@ def parse_config(config, min_input_count=2):
         raise FileNotFoundError
     
     # Parse and validate the configuration file
-    config = ConfigObj(str(config), configspec=io.StringIO(CONFIG_SPECS))
-    validator = Validator()
-    results = config.validate(validator, preserve_errors=True)
+    config = ConfigObj(str(config), configspec=SPEC)
+    results = config.validate(VALIDATOR, preserve_errors=True)
 
     # Validate that the configuration contains at least two inputs
-    if len(list_particle_key(config)) < min_input_count:
+    particles = list_particle_key(config)
+    if len(particles) < min_input_count:
         msg = "The configuration file does not contain two input sections."
         raise ConfigError(msg)
 
     # Validate that either a mask or radius is provided for each particle
-    for particle in list_particle_key(config):
+    for particle in particles:
         if not config['Input'][particle]["Radius"] and not config['Input'][particle]["MaskFile"]: 
             msg = "No mask file or particle radius is provided in the configuration for the particle \"{}\".".format(particle)
             raise ConfigError(msg)
@@ -89,6 +94,10 @@ def parse_config(config, min_input_count=2):
     # Only VdtTypeError and VdtValueError are caught as there are no validation that 
     # would return VdtValueTooSmallError, VdtValueTooBigError, VdtValueTooShortError or 
     # VdtValueTooLongError
+    # The results are only analysed when the validation failed (results is True otherwise)
+    if results is True:
+        return config
+
     for entry in flatten_errors(config, results):
         section_list, key, error = entry
         if error == False:
@@ -18,20 +18,38 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
 import sys
+import csv
+import concurrent.futures
 import configparser
-import itertools
-import operator
-import math
 import pathlib 
 import logging 
 
 from skimage import io
+from scipy import ndimage
 import numpy as np 
 import pandas as pd
 
+from dctracker.accelerated import NUMBA_AVAILABLE, keep_mask, keep_mask_pandas
+
+# PyArrow is optional. When it is installed, TrackMate files are parsed with its multithreaded CSV reader
+try:
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa_csv = None
+
 pd.options.mode.chained_assignment = None # Ignore 182: SettingWithCopyWarning
 pd.options.display.max_rows = None
 
+# Neighbours are +/- 1 excluding diagonals
+NEIGHBOUR_STRUCTURE = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+
+# Offset added to the pixel coordinates when the positions are packed in a single integer
+POSITION_OFFSET = 1 << 20
+POSITION_XY_MASK = (1 << 42) - 1
+
+# Particle ID used for missing particles when the colocalisation matrix is handled as an integer array
+MISSING_ID = np.iinfo(np.int64).max
+
 
 class InvalidCentroidError(RuntimeError):
     """Raise if a centroid index is not present in the mask"""
@@ -43,9 +61,14 @@ class DCTracker:
     """
 
     def __init__(self, params):
-        # Get the logger
-        self.logger = logging.getLogger()
+        # Get the logger (the context is added to every record by the adapter)
         self.CONTEXT = "DCTracker"
+        self.logger = logging.LoggerAdapter(logging.getLogger(), {'context': self.CONTEXT})
+
+        # Parsed track files, the same file is read to get the frame count and to generate its table
+        self.tracks = dict()
+        # Decoded mask files, the same mask can be used by more than one particle
+        self.masks = dict()
 
         self.description = params[0]
         self.particles = params[1:]
@@ -53,81 +76,77 @@ class DCTracker:
 
 
     def main(self):
-        # Determine the number of frames in the movie. This information is required to process static particles properly
+        # Process the input files to generate the tables, each track file is parsed once
+        # The particle tables are independent, so they are generated in threads (the parsing, decoding and labelling
+        # are done in C). Processes are not used since DCTracker already runs in the pipeline worker processes
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.particles)) as executor:
+            tables = list(executor.map(self.particle_table, self.particles))
+
+        # Determine the number of frames in the movie from the non-static particles (their tracks are already parsed)
+        # This information is required to process static particles properly, so they are broadcasted afterward
         # It is expected (but not required) that non-static particle have the same number of frame
         frame_count = []
         for particle in self.particles:
             if not particle['Static']:
                 tracks = self.parse_trackmate(track_file=particle['TrackFile'])
-            frame_count.append(tracks['FRAME'].max()+1)
-        
+                frame_count.append(tracks['FRAME'].max()+1)
+
         if frame_count:
             frame_count = max(frame_count)
         else: # Should only occur if not particle are movies 
             frame_count = 1 
 
-        # Process the input files to generate the tables
-        i = 0
-        tables = list()
-        for particle in self.particles:
-            name = particle['Name']
-
-            if particle['MaskFile']:
-                if particle['Static']:
-                    table = self.mask_to_table(track_file=particle['TrackFile'], mask_file=particle['MaskFile'], pixel_size=self.description['PixelSize'], static=True)
-                    table = self.make_static(table, name) # Remove tracks where frame is not 0
-                    table = self.expand_static_table(table, frame_count)
-                else:
-                    table = self.mask_to_table(track_file=particle['TrackFile'], mask_file=particle['MaskFile'], pixel_size=self.description['PixelSize'])
+        # Merge the tables on their packed (X, Y, FRAME) position, so each table is hashed once on a single column when joined
+        # Static mask particles are not expanded to every frame, their tables (at frame 0) are merged separately and
+        # broadcasted to the frames of the movie afterward
+        df = None
+        static_df = None
+        for particle, table in zip(self.particles, tables):
+            table = self.position_index(table)
+            if particle['MaskFile'] and particle['Static']:
+                static_df = table if static_df is None else static_df.join(table, how='outer', sort=False)
             else:
-                table = self.centroid_to_table(track_file=particle['TrackFile'], radius=particle['Radius'], pixel_size=self.description['PixelSize'])
-
-            table.rename({'TRACK_ID': name}, axis=1, inplace=True)
-            tables.append(table)
-            i += 1
-
-        # Merge the tables 
-        df = tables[0]
-        name = list(df.columns.values)[2]
-
-        i = 1
-        for table in tables[1:]:
-            name = list(table.columns.values)[2]
-            df = pd.merge(df, table, how="outer", on=["X", "Y", "FRAME"])
-            i += 1
-
-        # Keep the particle combinaisons with/without interaction
-        df.drop(["X", "Y"], axis=1, inplace=True)
-        df.drop_duplicates(inplace=True)
-
-        # Order the dataframe with frame as the first column
-        cols = list(df.columns.values) 
-        order = [cols[1]] + [cols[0]] + cols[2:]   
-        df = df.reindex(columns=order)
-        df.sort_values(by=order, inplace=True)
+                df = table if df is None else df.join(table, how='outer', sort=False)
+
+        if df is None: # Should only occur if every particle is static
+            df = pd.DataFrame(index=pd.Index([], dtype=np.int64))
+        frames = df.index.to_numpy() >> 42
+
+        if static_df is not None:
+            df, frames = self.broadcast_static(df, static_df, frame_count)
+
+        # Keep the particle combinaisons with/without interaction (with frame as the first column)
+        names = [particle['Name'] for particle in self.particles]
+        df = df[names]
+        cols = ['FRAME'] + names
+
+        # Missing particles are encoded with the largest integer, so they are ordered last like NaN in pandas
+        missing = df.isna().to_numpy()
+        ids = df.fillna(-1).to_numpy(dtype=np.int64)
+        ids[missing] = MISSING_ID
+        rows = np.column_stack((frames, ids))
+
+        # Order the combinaisons (by frame, then by particle) and remove the duplicates in a single pass on the array
+        rows = rows[np.lexsort(rows.T[::-1])]
+        unique = np.ones(len(rows), dtype=bool)
+        unique[1:] = (rows[1:] != rows[:-1]).any(axis=1)
+        rows = rows[unique]
+        frames = rows[:, 0]
+        missing = rows[:, 1:] == MISSING_ID
+        ids = np.where(missing, -1, rows[:, 1:])
 
         # Keep rows with NaN in any columns only if the values in the other columns are not present elsewhere in the table
-        frames = []
-        for k,g in df.groupby(by="FRAME"):
-            # Create a boolean mask of rows that have NaN values
-            nan_mask = g.isna().any(axis=1)
-
-            # Create a boolean mask of rows that have unique values in at least one column
-            unique_masks = []
-            for col in g.columns[1:]:
-                unique_mask = g[col].isin(g[col].value_counts()[g[col].value_counts()==1].index)
-                unique_masks.append(unique_mask)
-            keep_mask = np.any(unique_masks, axis=0)
-
-            # Combine the masks and apply them to the DataFrame
-            keep = ~nan_mask | keep_mask
-            g = g[keep].reset_index(drop=True)
-            frames.append(g)
-        df = pd.concat(frames, axis=0)
-        
-        # Change the particle ID type to Int64 (to accept NaN) to simplify the output
-        for col in cols:
-            df[col] = df[col].astype('Int64')
+        # The rows are sorted by frame, so the rows of each frame are contiguous as required by the kernel
+        # Without Numba, the kernel would run as a Python loop, so the vectorized pandas version is used instead
+        if NUMBA_AVAILABLE:
+            keep = keep_mask(frames, ids)
+        else:
+            keep = keep_mask_pandas(frames, ids)
+
+        # The particle IDs are stored as Int32 (to accept NaN, IDs and frames fit in 32 bits) to simplify the output
+        df = pd.DataFrame({'FRAME': pd.array(frames[keep].astype(np.int32), dtype='Int32')})
+        for j, col in enumerate(cols[1:]):
+            df[col] = pd.arrays.IntegerArray(ids[keep, j].astype(np.int32), missing[keep, j])
 
         # Write the output 
         pathlib.Path(self.description['Output']).mkdir(parents=True, exist_ok=True)
@@ -137,135 +156,227 @@ class DCTracker:
             df.to_csv(f, index=False)
 
 
+    def particle_table(self, particle):
+        """Generate the table of a particle with the particle name as the track ID column"""
+        name = particle['Name']
+
+        if particle['MaskFile']:
+            if particle['Static']:
+                table = self.mask_to_table(track_file=particle['TrackFile'], mask_file=particle['MaskFile'], pixel_size=self.description['PixelSize'], static=True)
+                table = self.make_static(table, name) # Remove tracks where frame is not 0
+            else:
+                table = self.mask_to_table(track_file=particle['TrackFile'], mask_file=particle['MaskFile'], pixel_size=self.description['PixelSize'])
+        else:
+            table = self.centroid_to_table(track_file=particle['TrackFile'], radius=particle['Radius'], pixel_size=self.description['PixelSize'])
+
+        table.rename({'TRACK_ID': name}, axis=1, inplace=True)
+        return table
+
+
+    def position_index(self, table):
+        """
+        Index a particle table by its positions packed in a single integer: 21 bits for each coordinate
+        (offset to accept the negative coordinates of centroids close to the border) and the frame in the upper bits
+        """
+        x = table['X'].to_numpy(dtype=np.int64) + POSITION_OFFSET
+        y = table['Y'].to_numpy(dtype=np.int64) + POSITION_OFFSET
+        frame = table['FRAME'].to_numpy(dtype=np.int64)
+        index = pd.Index((frame << 42) | (y << 21) | x, name='POSITION')
+        return table.drop(columns=['X', 'Y', 'FRAME']).set_index(index)
+
+
     def mask_to_table(self, track_file, mask_file, pixel_size, static=False):
         """Generate a hash from a mask"""
 
         tracks = self.parse_trackmate(track_file)
-        mask = io.imread(mask_file)
-
-        x = []
-        y = []
-        ids = []
-        times = []
-        centroids = dict()
-
-        neighbour_dist = [(-1, 0), (0, -1), (0, 0), (0, 1), (1, 0)] # Neighbour distances are +/- 1 excluding diagonals
-        for track in tracks.iterrows():
-            track_id = int(track[1]['TRACK_ID'])
-            track_time = int(track[1]['FRAME'])
-            track_x = int(round(track[1]['POSITION_X']/pixel_size))
-            track_y = int(round(track[1]['POSITION_Y']/pixel_size))
-
-            if not track_time in centroids:
-                centroids[track_time] = dict()
-            centroids[track_time][track_id] = (track_x, track_y)
-
-            visited = set()
-            
+        mask = self.read_mask(mask_file)
+
+        # A movie mask has a frame dimension and a static mask is a single frame, otherwise the centroids cannot be found
+        if mask.ndim != (2 if static else 3):
+            raise InvalidCentroidError()
+
+        # Positions of the particles, stored as an array per track (or per frame) and concatenated once
+        # (the lists start with an empty array to concatenate them when no particle is found)
+        x = [np.empty(0, dtype=np.int64)]
+        y = [np.empty(0, dtype=np.int64)]
+        ids = [np.empty(0, dtype=np.int64)]
+        times = [np.empty(0, dtype=np.int64)]
+        shared = [np.empty(0, dtype=bool)]
+        centroid_x = [np.empty(0, dtype=np.int64)]
+        centroid_y = [np.empty(0, dtype=np.int64)]
+
+        # Convert the centroids to pixel coordinates in a single pass (np.rint rounds half to even, like round)
+        track_ids = tracks['TRACK_ID'].to_numpy(dtype=np.int64)
+        track_times = tracks['FRAME'].to_numpy(dtype=np.int64)
+        track_xs = np.rint(tracks['POSITION_X'].to_numpy()/pixel_size).astype(np.int64)
+        track_ys = np.rint(tracks['POSITION_Y'].to_numpy()/pixel_size).astype(np.int64)
+
+        # Process the tracks frame by frame (keeping the track order within a frame), so the connected
+        # components of a single mask frame are labelled and kept in memory at a time
+        track_order = np.argsort(track_times, kind='stable')
+        frames, frame_starts = np.unique(track_times[track_order], return_index=True)
+
+        # A static mask contains a single frame that is used for every track
+        if static:
+            frame_labels, _ = ndimage.label(mask, structure=NEIGHBOUR_STRUCTURE)
+            frame_pixels = ndimage.value_indices(frame_labels, ignore_value=0)
+
+        for frame, frame_tracks in zip(frames.tolist(), np.split(track_order, frame_starts[1:])):
+            try:
+                if not static:
+                    frame_labels, _ = ndimage.label(mask[frame], structure=NEIGHBOUR_STRUCTURE)
+                    frame_pixels = ndimage.value_indices(frame_labels, ignore_value=0)
+                track_labels = frame_labels[track_ys[frame_tracks], track_xs[frame_tracks]]
+            except IndexError:
+                raise InvalidCentroidError()
+
             # Ignore centroids when the mask does not contain a particle at the centroid center
-            if static:
-                try:
-                    if mask[track_y][track_x] != 0:
-                        visited.add((track_x, track_y))
-                except IndexError:
-                    print("INVALID")
-                    raise InvalidCentroidError()
-            else:
-                try:
-                    if mask[track_time][track_y][track_x] != 0: 
-                        visited.add((track_x, track_y))
-                except IndexError:
-                    raise InvalidCentroidError()
-
-            completed = set()
-
-            # Add each positive positions to the completed list
-            while visited: # Done when there are no new nodes to visit
-                v = visited.pop()
-                completed.add(v)
-                neighbour = [tuple(map(operator.add, v, x)) for x in neighbour_dist]
-                for n in neighbour:
-                    if not n in completed:
-                        if static:
-                            try:
-                                if mask[int(n[1])][int(n[0])] != 0:
-                                    visited.add(n)
-                            except IndexError:
-                                pass 
-                        else:
-                            try:
-                                if mask[track_time][int(n[1])][int(n[0])] != 0:
-                                    visited.add(n)
-                            except IndexError:
-                                pass
-            
-            # Add the results to the lists
-            x.extend([c[0] for c in completed])
-            y.extend([c[1] for c in completed])
-            ids.extend(itertools.repeat(track_id, len(completed)))
-            times.extend(itertools.repeat(track_time, len(completed)))
+            found = track_labels != 0
+
+            # Add the positions of the particles at the centroids to the lists
+            # (the positions of every particle of the frame are indexed by label in a single pass)
+            # The IDs and frames of the positions are generated once per frame from the particle sizes
+            sizes = []
+            for label in track_labels[found].tolist():
+                completed_y, completed_x = frame_pixels[label]
+                x.append(completed_x)
+                y.append(completed_y)
+                sizes.append(len(completed_x))
+            ids.append(np.repeat(track_ids[frame_tracks][found], sizes))
+            times.append(np.full(sum(sizes), frame, dtype=np.int64))
+
+            # The particles of a frame are disjoint, so a position can only be attributed to more than one track
+            # when their centroids are in the same particle. The overlaps are found once per particle instead of per position
+            _, label_inverse, label_counts = np.unique(track_labels[found], return_inverse=True, return_counts=True)
+            shared.append(np.repeat(label_counts[label_inverse] > 1, sizes))
+
+            # Centroid of the track of each position, used to attribute the overlapping positions
+            # (when a track is found twice in a frame, the last centroid is used)
+            _, id_inverse = np.unique(track_ids[frame_tracks], return_inverse=True)
+            last = np.zeros(id_inverse.max()+1, dtype=np.int64)
+            last[id_inverse] = frame_tracks
+            centroid_x.append(np.repeat(track_xs[last[id_inverse]][found], sizes))
+            centroid_y.append(np.repeat(track_ys[last[id_inverse]][found], sizes))
         
-        df = pd.DataFrame(list(zip(x, y, ids, times)), columns=['X', 'Y', 'TRACK_ID', 'FRAME'])
+        df = pd.DataFrame({'X': np.concatenate(x), 'Y': np.concatenate(y), 'TRACK_ID': np.concatenate(ids), 'FRAME': np.concatenate(times)})
 
         # Filter overlapping particles
-        unique = df.drop_duplicates(subset = ['X', 'Y', 'FRAME'], keep = False)
-        duplicated = df[df.duplicated(subset = ['X', 'Y', 'FRAME'], keep = False)]
+        overlapping = np.concatenate(shared)
+        duplicated = df[overlapping]
 
         # Distance between the potential centroid and any position attributed to the particule with the centroid
         if not duplicated.empty:
-            duplicated['DISTANCE'] = duplicated.apply(lambda x: math.sqrt((x['X']-centroids[x['FRAME']][x['TRACK_ID']][0])**2 + (x['Y']-centroids[x['FRAME']][x['TRACK_ID']][1])**2), axis=1)
-
-            selected = list()
-            for k, g in duplicated.groupby(by = ['X', 'Y', 'FRAME']):
-                selected.append(g.sort_values(by = ['DISTANCE']).iloc[0]) # Keep the track were the centroid is closer to the point 
-            
-            selected_df = pd.DataFrame(selected)
-            selected_df.drop(labels='DISTANCE', axis=1, inplace=True)
-            selected_df = selected_df.astype(int)
-            frames = [unique, selected_df]
-            df = pd.concat(frames)
-        else:  
-            df = unique
+            distance_x = duplicated['X'].to_numpy() - np.concatenate(centroid_x)[overlapping]
+            distance_y = duplicated['Y'].to_numpy() - np.concatenate(centroid_y)[overlapping]
+            # The squared distance is used, since the square root does not change which track is closer
+            duplicated['DISTANCE'] = distance_x*distance_x + distance_y*distance_y
+
+            # Keep the track were the centroid is closer to the point (the first track is kept for equal distances)
+            closest = duplicated.groupby(by = ['X', 'Y', 'FRAME'])['DISTANCE'].idxmin()
+
+            # Select the unique positions and the closest tracks at once instead of concatenating them
+            keep = ~overlapping
+            keep[df.index.get_indexer(closest)] = True
+            df = df[keep]
 
         return df 
 
 
+    def read_mask(self, mask_file):
+        """Read a mask file (each file is decoded once)"""
+        if not mask_file in self.masks:
+            self.masks[mask_file] = io.imread(mask_file)
+        return self.masks[mask_file]
+
+
     def make_static(self, table, name):
         """Make a dataframe static by removing tracks with frame that are not 0"""
         if not table[table['FRAME'] > 0].empty:
-            self.logger.warning("Expected a static image but found multiple time frame for '{}'".format(name), extra={'context': self.CONTEXT})
+            self.logger.warning("Expected a static image but found multiple time frame for '{}'".format(name))
         table = table[table['FRAME'] == 0]
         return table
 
 
-    def expand_static_table(self, table, frame_count):
-        """Expand a static table (with a singe frame) to match the number of frame of the movie"""
-        df = pd.concat([table]*frame_count, ignore_index=True)
-        frame = []
-        for i in range(0,frame_count):
-            frame.extend([i]*len(table))
-        df["FRAME"] = frame 
+    def broadcast_static(self, df, static_df, frame_count):
+        """
+        Broadcast the merged static particles to every frame of the movie. The result contains the same particle
+        combinaisons as the static tables expanded to every frame and merged with the moving particles:
+        - the positions of the moving particles get the static particles at the same pixel
+        - a static combinaison is added alone to a frame when some of its pixels are not covered by a moving particle
 
-        return df
+        Arguments:
+            df (DataFrame): Moving particles indexed by packed position
+            static_df (DataFrame): Static particles indexed by packed position (at frame 0)
+            frame_count (int): Number of frames in the movie
 
+        Return:
+            tuple: Particle combinaisons (DataFrame) and their frames (ndarray)
+        """
+        positions = df.index.to_numpy()
+        static_positions = static_df.index.to_numpy()
 
-    def parse_trackmate(self, track_file):
-        """Parse a trackmate file"""
+        # Static particles without a mask (centroids) keep all their frames, which can be after the last frame of the movie
+        # The static masks are only broadcasted to the frames of the movie, so these positions are not joined or counted
+        in_movie = (positions >> 42) < frame_count
+
+        # Static particles at the position of the moving particles (-1 is not a packed position, so it is never joined)
+        df = df.reset_index(drop=True)
+        df['POSITION'] = np.where(in_movie, positions & POSITION_XY_MASK, -1)
+        df = df.join(static_df, on='POSITION', how='left').drop(columns='POSITION')
+
+        # Static combinaisons and their number of pixels
+        combinaisons = static_df.drop_duplicates()
+        static_codes = static_df.groupby(list(static_df.columns), dropna=False, sort=False).ngroup().to_numpy()
+        sizes = np.bincount(static_codes, minlength=len(combinaisons))
+
+        # Number of pixels of each static combinaison covered by a moving particle in each frame
+        covered = np.unique(positions[in_movie & np.isin(positions & POSITION_XY_MASK, static_positions)])
+        covered_codes = static_codes[static_df.index.get_indexer(covered & POSITION_XY_MASK)]
+        covered_counts = np.zeros((frame_count, len(combinaisons)), dtype=np.int64)
+        np.add.at(covered_counts, (covered >> 42, covered_codes), 1)
 
-        tracks = pd.read_csv(track_file, sep=',', header = 0, usecols=['TRACK_ID', 'POSITION_X', 'POSITION_Y', 'FRAME'])
+        # Static combinaisons found alone in each frame
+        uncovered_frames, uncovered_codes = np.nonzero(covered_counts < sizes)
+        uncovered = combinaisons.iloc[uncovered_codes].reset_index(drop=True)
+
+        frames = np.concatenate((positions >> 42, uncovered_frames))
+        return pd.concat([df, uncovered], ignore_index=True), frames
+
+
+    def parse_trackmate(self, track_file):
+        """Parse a trackmate file (each file is parsed once, the callers must not modify the returned dataframe)"""
+        if track_file in self.tracks:
+            return self.tracks[track_file]
+
+        # In version 7 TrackMate added three additional header rows, they are detected from the first row
+        # after the header (the frame of a spot is always numeric) and skipped while parsing
+        with open(track_file, newline='') as f:
+            reader = csv.reader(f)
+            columns = next(reader)
+            first_row = next(reader, None)
+        header_rows = 0
+        try:
+            if first_row is not None:
+                float(first_row[columns.index('FRAME')])
+        except ValueError:
+            header_rows = 3
+
+        # The columns are parsed with their numeric types directly, the spots that are not part of a track
+        # have an empty track id (version 7) or 'None' (version 6) that are parsed as NaN
+        dtypes = {'TRACK_ID': 'float64', 'POSITION_X': 'float64', 'POSITION_Y': 'float64', 'FRAME': 'int64'}
+        null_values = ['', 'None']
+        if pa_csv is not None:
+            read_options = pa_csv.ReadOptions(skip_rows_after_names=header_rows)
+            convert_options = pa_csv.ConvertOptions(include_columns=list(dtypes), column_types=dtypes, null_values=null_values)
+            tracks = pa_csv.read_csv(track_file, read_options=read_options, convert_options=convert_options).to_pandas()
+        else:
+            tracks = pd.read_csv(track_file, sep=',', header=0, skiprows=range(1, header_rows+1), usecols=list(dtypes), 
+                                 dtype=dtypes, na_values=null_values, keep_default_na=False)
         
-        # In version 7 TrackMate added three additional header rows
-        # To maintain compatibility with version 6, header rows are removed by removing rows 
-        # where the track id is not numeric
-        # Conversion to string before numeric check to avoid error with float/int types
-        tracks = tracks[tracks["TRACK_ID"].astype(str).str.isnumeric()]
-
-        # TrackMate header changed the columns type to str. 
-        # Changing numeric columns types back to int
-        tracks['POSITION_X'] = pd.to_numeric(tracks['POSITION_X'])
-        tracks['POSITION_Y'] = pd.to_numeric(tracks['POSITION_Y'])
-        tracks['FRAME'] = pd.to_numeric(tracks['FRAME'])
+        # Remove the spots that are not part of a track
+        tracks = tracks[tracks['TRACK_ID'].notna()]
 
+        self.tracks[track_file] = tracks
         return tracks
 
 
@@ -273,30 +384,22 @@ class DCTracker:
         """Generate a hash from a list of centroids"""
         tracks = self.parse_trackmate(track_file)
 
-        x = []
-        y = []
-        ids = []
-        times = []
-
         radius_px = int(round(radius/pixel_size))
 
-        particle_sphere = list(itertools.product(range(-radius_px, radius_px+1), range(-radius_px, radius_px+1)))
-        
-        for track in tracks.iterrows():
-            track_id = int(track[1]['TRACK_ID'])
-            track_time = int(track[1]['FRAME'])
-            track_x = int(round(track[1]['POSITION_X']/pixel_size))
-            track_y = int(round(track[1]['POSITION_Y']/pixel_size))
-
-            centroid = (track_x, track_y)
-
-            particle = [tuple(map(operator.add, centroid, x)) for x in particle_sphere]
-
-            # Add the results to the lists
-            x.extend([p[0] for p in particle])
-            y.extend([p[1] for p in particle])
-            ids.extend(itertools.repeat(track_id, len(particle)))
-            times.extend(itertools.repeat(track_time, len(particle)))
-        
-        df = pd.DataFrame(list(zip(x, y, ids, times)), columns=['X', 'Y', 'TRACK_ID', 'FRAME'])
+        # Position of the particle pixels relative to the centroid
+        offset_x, offset_y = np.meshgrid(np.arange(-radius_px, radius_px+1), np.arange(-radius_px, radius_px+1), indexing='ij')
+        offset_x = offset_x.ravel()
+        offset_y = offset_y.ravel()
+
+        # Convert the centroids to pixel coordinates in a single pass (np.rint rounds half to even, like round)
+        track_xs = np.rint(tracks['POSITION_X'].to_numpy()/pixel_size).astype(np.int64)
+        track_ys = np.rint(tracks['POSITION_Y'].to_numpy()/pixel_size).astype(np.int64)
+
+        # Expand every centroid to its particle pixels by broadcasting the offsets over the tracks
+        df = pd.DataFrame({
+            'X': (track_xs[:, None] + offset_x).ravel(),
+            'Y': (track_ys[:, None] + offset_y).ravel(),
+            'TRACK_ID': np.repeat(tracks['TRACK_ID'].to_numpy(dtype=np.int64), offset_x.size),
+            'FRAME': np.repeat(tracks['FRAME'].to_numpy(dtype=np.int64), offset_x.size),
+        })
         return df 
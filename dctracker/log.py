@@ -44,15 +44,16 @@ class ColoredFormatter(logging.Formatter):
                 logging.ERROR: self.BOLD_RED + self.fmt + self.RESET,
                 logging.CRITICAL: self.BOLD_RED + self.fmt + self.RESET
             }
-        
 
-    def format(self, record):
+        # Create the formatters once instead of for each record
+        self.formatter = logging.Formatter(self.fmt, datefmt=self.datefmt)
+        self.FORMATTERS = dict()
         if self.FORMATS:
-            log_fmt = self.FORMATS.get(record.levelno)
-        else:
-            log_fmt = self.fmt
+            self.FORMATTERS = {level: logging.Formatter(log_fmt, datefmt=self.datefmt) for level, log_fmt in self.FORMATS.items()}
         
-        formatter = logging.Formatter(log_fmt, datefmt=self.datefmt)
+
+    def format(self, record):
+        formatter = self.FORMATTERS.get(record.levelno, self.formatter)
         return formatter.format(record)
 
     
@@ -17,19 +17,23 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import argparse
+import concurrent.futures
+import csv
 import os
 import sys
+import stat
 import pathlib
 import datetime 
 import multiprocessing
 import logging
 import itertools
 import re 
+import fnmatch
+import glob
 from platform import python_version
 
 import configobj
 from ansi2html import Ansi2HTMLConverter
-import pandas as pd
 
 try:
     from PyQt6 import QtCore
@@ -44,6 +48,18 @@ from dctracker.config import *
 from dctracker.version import __version__
 
 
+# Config values accepted as true for the yes/no options (compared in lower case)
+TRUE_OPTIONS = frozenset({'y', 'yes'})
+
+# Characters replaced by '_' in the output directory names
+SANITIZE_RE = re.compile('[^0-9a-zA-Z-]+')
+
+# Parsed configuration and metadata files, keyed by (path, modification time) so an edited file is parsed again
+# The GUI can run several analyses in the same process with the same files
+CONFIG_CACHE = dict()
+METADATA_CACHE = dict()
+
+
 class InvalidInputError(Exception):
     """Raise if an input unit does not contain a file described in the config"""
 
@@ -58,21 +74,24 @@ class Runner():
     """
 
     def __init__(self):
-        # Start the logger
-        self.logger = Logger().logger
+        # Start the logger (the context is added to every record by the adapter)
         self.CONTEXT = "Main"
+        self.logger = logging.LoggerAdapter(Logger().logger, {'context': self.CONTEXT})
     
     def main(self):
         # Set the content and start logging at this point (everything logged before is fatal errors)
-        self.logger.info("Starting CoPixie (version {})".format(__version__), extra={'context': self.CONTEXT})
-        self.logger.debug("Python version: {}".format(python_version()), extra={'context': self.CONTEXT})
+        self.logger.info("Starting CoPixie (version {})".format(__version__))
+        self.logger.debug("Python version: {}".format(python_version()))
 
         # Validate that the inputs and output exists and are readable or writable
         self.validate_user_parameters()
 
         # Parse the configuration and handle the configuration errors
+        config_key = (os.fspath(self.config_file), os.stat(self.config_file).st_mtime_ns)
         try:
-            self.config = parse_config(self.config_file)
+            if config_key not in CONFIG_CACHE:
+                CONFIG_CACHE[config_key] = parse_config(self.config_file)
+            self.config = CONFIG_CACHE[config_key]
         except configobj.ConfigObjError as e:
             raise HaltException("Invalid configuragion file. Make sure the configuration is correct. Complete error message (for debugging): \n" + str(e))
         except ConfigError as e:
@@ -82,15 +101,21 @@ class Runner():
         except ConfigTypeError as e:
             raise HaltException(e.args[0])
 
-        self.logger.info("Found a valid configuration.", extra={'context': self.CONTEXT})
+        self.logger.info("Found a valid configuration.")
+
+        # Plain copies of the particle sections, they are read for every cell
+        self.particle_configs = {name: dict(self.config['Input'][name]) for name in list_particle_key(self.config)}
 
         # Parse the metadata
+        metadata_key = (os.fspath(self.metadata_file), os.stat(self.metadata_file).st_mtime_ns)
         try:
-            self.metadata = self.parse_metadata()
+            if metadata_key not in METADATA_CACHE:
+                METADATA_CACHE[metadata_key] = self.parse_metadata()
+            self.metadata = METADATA_CACHE[metadata_key]
         except RuntimeError as e:
             raise HaltException(e)
 
-        self.logger.info("Found a valid metadata file.".format(len(self.metadata)), extra={'context': self.CONTEXT})
+        self.logger.info("Found a valid metadata file.".format(len(self.metadata)))
 
         # Run DCTracker in parallel
         params = self.prepare_run()
@@ -112,7 +137,7 @@ class Runner():
         else:
             Pipeline(params)
 
-        self.logger.info("Done.", extra={'context': self.CONTEXT})
+        self.logger.info("Done.")
 
 
     def parse_metadata(self):
@@ -125,22 +150,22 @@ class Runner():
         Return:
             dict: Parsed metadata
         """
-        metadata = dict()
         with open(self.metadata_file) as h:
-            for l in h:
-                # Ignore blank line and comment line (line starting with #)
-                if not l.startswith("#") or l.strip() == "":
-                    l = l.strip().split(",")
-                    # Raise an error if the metadata does not contain the 3 columns required
-                    if len(l) != 3:
-                        raise RuntimeError("Metadata contains {} columns but 3 were expected. Please refer to the documentation for the metadata file format.".format(len(l)))
-                    
-                    # Add key to dict if it does not exist yet
-                    if not l[0] in metadata:
-                        metadata[l[0]] = []
-                    
-                    # Add the entry to the metadata dict 
-                    metadata[l[0]].append([l[1], l[2]])
+            lines = h.read().splitlines()
+
+        # Ignore blank line and comment line (line starting with #, leading whitespace is ignored)
+        # The columns are split by the csv reader, so a quoted path can contain a comma
+        stripped = (l.strip() for l in lines)
+        entries = csv.reader(l for l in stripped if l and not l.startswith("#"))
+
+        metadata = dict()
+        for l in entries:
+            # Raise an error if the metadata does not contain the 3 columns required
+            if len(l) != 3:
+                raise RuntimeError("Metadata contains {} columns but 3 were expected. Please refer to the documentation for the metadata file format.".format(len(l)))
+
+            # Add the entry to the metadata dict (the condition key is added if it does not exist yet)
+            metadata.setdefault(l[0], []).append([l[1], l[2]])
 
         return metadata
 
@@ -158,85 +183,83 @@ class Runner():
 
         # Prepare the datastructue for the DCTracker module
         dctracker_args = []
+        pixel_size = self.config['General']['PixelSize']
+        frame_interval = self.config['General']['FrameInterval']
+
+        # List the expected file name/relative path based on the configuration information
+        expected_files = []
+        for particle_config in self.particle_configs.values():
+            if particle_config['TrackFile']:
+                expected_files.append(particle_config['TrackFile'])
+            if particle_config['MaskFile']:
+                expected_files.append(particle_config['MaskFile'])
+
+        # Parse the filestructure of every replicate in threads, the walks are mostly waiting on the filesystem
+        # The results are used in the metadata order below
+        replicates = [(condition, replicate) for condition in self.metadata for replicate in self.metadata[condition]]
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            walks = executor.map(self.find_analysis_files, [pathlib.Path(r[1]) for c, r in replicates], itertools.repeat(expected_files))
 
         # Iterate through every element of every conditions, than analyse the file structure to identify the cells 
-        for condition in self.metadata:
-            for replicate in self.metadata[condition]:
-                # Replicate information
-                replicate_id = replicate[0]
-                replicate_path = pathlib.Path(replicate[1])
-                
-                if replicate_path.is_dir():
-                    no_analysis_directory = False 
-                else:
-                    self.logger.warning("The directory \"{}\" does not exist. Please check that the paths in the metadata correct.".format(replicate_path), extra={'context': self.CONTEXT})
-
-                # List the expected file name/relative path based on the configuration information
-                expected_files = []
-                for particle in self.config['Input']:
-                    if self.config['Input'][particle]['TrackFile']:
-                        expected_files.append(self.config['Input'][particle]['TrackFile'])
-                    if self.config['Input'][particle]['MaskFile']:
-                        expected_files.append(self.config['Input'][particle]['MaskFile'])
-
-                # Empty structure to list the file in the analysis filestructure
-                analysis_files = {key: list() for key in expected_files}
-
-                # Parse the analysis filestructure searching for the expected file name/relative path
-                for path in replicate_path.rglob('*'):
-                    if path.is_file():
-                        for k in analysis_files:
-                            if path.match(k):
-                                # Get the cell path by removing the path from the config (this can include a file and folder)
-                                suffix_len = len(pathlib.Path(k).parts)
-                                cell_path = pathlib.Path(*path.parts[:-suffix_len])
-                                analysis_files[k].append(cell_path)
-
-                # Extract all the cell folder identified in the previous step
-                # The folder does not need to contain all the required file (based on the config)
-                # Incomplete folders will be handled after 
-                cell_folders = set(itertools.chain.from_iterable(analysis_files.values()))
-
-                if not cell_folders:
-                    raise HaltException("No valid cell folder were found. Nothing to analyze.")
-                
-                # Identify the part in the path that varies between the cells 
-                # This segment of the paths will be used as the label of the cells 
-                folder_lst = []
-                for folder in cell_folders:
-                    folder_lst.append(folder.parts)
-                df = pd.DataFrame(folder_lst)
-
-                # Efficient solution to identify columns where all values are identical (source: https://stackoverflow.com/a/54405767)
-                def unique_cols(df):
-                    a = df.to_numpy() # df.values (pandas<0.24)
-                    return (a[0] == a).all(0)
-                
-                label_start = -1
-                if not unique_cols(df).all():
-                    label_start = unique_cols(df).tolist().index(False)
+        for (condition, replicate), analysis_files in zip(replicates, walks):
+            # Replicate information
+            replicate_id = replicate[0]
+            replicate_path = pathlib.Path(replicate[1])
+            
+            if replicate_path.is_dir():
+                no_analysis_directory = False 
+            else:
+                self.logger.warning("The directory \"{}\" does not exist. Please check that the paths in the metadata correct.".format(replicate_path))
+
+            # Extract all the cell folder identified in the previous step
+            # The folder does not need to contain all the required file (based on the config)
+            # Incomplete folders will be handled after 
+            cell_folders = set(itertools.chain.from_iterable(analysis_files.values()))
+
+            # Keep the expected files found in each cell folder, so they do not need to be checked again
+            # Patterns are not kept as they do not name an actual file
+            cell_files = {folder: set() for folder in cell_folders}
+            for k, folders in analysis_files.items():
+                if not glob.has_magic(k):
+                    for folder in folders:
+                        cell_files[folder].add(k)
+
+            if not cell_folders:
+                raise HaltException("No valid cell folder were found. Nothing to analyze.")
+            
+            # Identify the part in the path that varies between the cells 
+            # This segment of the paths will be used as the label of the cells 
+            # The first part that is not identical in every cell path (shorter paths are padded with None)
+            label_start = -1
+            for i, column in enumerate(itertools.zip_longest(*(folder.parts for folder in cell_folders))):
+                if any(part != column[0] for part in column):
+                    label_start = i
+                    break
+
+            # Output directory of the replicate, the cell labels are joined to it
+            replicate_output = pathlib.Path(self.output_dir, SANITIZE_RE.sub('_', condition), SANITIZE_RE.sub('_', replicate[0]))
+
+            # Parse the file structure
+            for folder in cell_folders:
+                # Generate the cell dictionary 
+                cell = dict()
+                label = ""
+                if label_start > 0:
+                    label = '/'.join(folder.parts[label_start:])
                 
-                # Parse the file structure
-                for folder in cell_folders:
-                    # Generate the cell dictionary 
-                    cell = dict()
-                    label = ""
-                    if label_start > 0:
-                        label = '/'.join(folder.parts[label_start:])
+                cell['Condition'] = condition
+                cell['Replicate'] = replicate
+                cell['Label'] = label
+                full_output_path = replicate_output.joinpath(*folder.parts[label_start:])
+                cell['Output'] = full_output_path
+                cell['PixelSize'] = pixel_size
+                cell['FrameInterval'] = frame_interval
                     
-                    cell['Condition'] = condition
-                    cell['Replicate'] = replicate
-                    cell['Label'] = label
-                    full_output_path = pathlib.Path(self.output_dir, re.sub('[^0-9a-zA-Z-]+', '_', condition), re.sub('[^0-9a-zA-Z-]+', '_', replicate[0]), *folder.parts[label_start:])
-                    cell['Output'] = full_output_path
-                    cell['PixelSize'] = self.config['General']['PixelSize']
-                    cell['FrameInterval'] = self.config['General']['FrameInterval']
-                        
-                    try:
-                        particles = self.parse_cell(folder)
-                        dctracker_args.append([cell] + particles)
-                    except InvalidInputError as e:
-                        self.logger.warning("Folder \"{}\" does not contain the file \"{}\".".format(folder, e), extra={'context': self.CONTEXT})
+                try:
+                    particles = self.parse_cell(folder, cell_files[folder])
+                    dctracker_args.append([cell] + particles)
+                except InvalidInputError as e:
+                    self.logger.warning("Folder \"{}\" does not contain the file \"{}\".".format(folder, e))
 
         # Handle invalid input
         if no_analysis_directory:
@@ -247,7 +270,71 @@ class Runner():
         return dctracker_args
 
 
-    def parse_cell(self, path):
+    def find_analysis_files(self, replicate_path, expected_files):
+        """Parse the filestructure of a replicate searching for the expected file name/relative path
+
+        Arguments:
+            replicate_path (Path): Replicate folder path
+            expected_files (list): Expected file name/relative path of every particle
+
+        Return:
+            dict: cell folders that contain each expected file
+        """
+        # Empty structure to list the file in the analysis filestructure
+        analysis_files = {key: list() for key in expected_files}
+
+        # The expected file can be in a sub-folder of the cell folder, split the folders from the file name
+        # The patterns are compiled once (in normal case, like fnmatch) and plain file names are looked up directly
+        matchers = []
+        for k in analysis_files:
+            *folders, file_name = pathlib.PurePath(k).parts
+            folder_matches = [re.compile(fnmatch.translate(os.path.normcase(f))).match for f in folders]
+            file_match = re.compile(fnmatch.translate(os.path.normcase(file_name))).match if glob.has_magic(file_name) else None
+            matchers.append((k, folder_matches, os.path.normcase(file_name), file_match))
+
+        # Each directory is listed once with scandir and the expected file names are looked up in its listing
+        # The path parts of the sub-directories are derived from their parent and kept on the stack
+        # Unreadable directories are skipped and symbolic links to directories are not followed
+        # Only regular files (or links to one) are listed, so a broken link is not found as an expected file
+        stack = [(os.fspath(replicate_path), replicate_path.parts)]
+        while stack:
+            dirpath, dir_parts = stack.pop()
+            listing = dict()
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir()
+                            is_file = not is_dir and entry.is_file()
+                        except OSError:
+                            is_dir = is_file = False
+                        if is_file:
+                            listing[os.path.normcase(entry.name)] = entry.name
+                        elif is_dir and not entry.is_symlink():
+                            stack.append((entry.path, dir_parts + (entry.name,)))
+            except OSError:
+                continue
+
+            for k, folder_matches, file_name, file_match in matchers:
+                # The end of the directory path must match the expected sub-folders
+                cell_len = len(dir_parts) - len(folder_matches)
+                if cell_len < 0 or not all(match(os.path.normcase(p)) for p, match in zip(dir_parts[cell_len:], folder_matches)):
+                    continue
+
+                # The listing is keyed by the file names in normal case
+                if file_match:
+                    found = any(file_match(name) for name in listing)
+                else:
+                    found = file_name in listing
+
+                # Get the cell path by removing the sub-folders from the config from the directory path
+                if found:
+                    analysis_files[k].append(pathlib.Path(*dir_parts[:cell_len]))
+
+        return analysis_files
+
+
+    def parse_cell(self, path, found_files=()):
         """Parse a cell folder and the config to retrive the information required to run DCTracker
 
         Exceptions:
@@ -255,50 +342,39 @@ class Runner():
         
         Arguments:
             path (str): Cell folder path
+            found_files (set): Expected files already found in the cell folder (not checked again)
 
         Return: 
             dict: particle dictionary for DCTracker module
         """
-        # Typical particle dictionary for DCTracker module
-        particle_dict = {
-            'Name': '',
-            'TrackFile': '',
-            'MaskFile': '', # Optional
-            'Radius': 0.0, # Optional but required if no mask
-            'Static': False,
-        }
-
-        # Fetch the general informations from the configuration file
         particles = [] 
 
-        for particle_name in list_particle_key(self.config):
-            particle = particle_dict.copy()
-            particle['Name'] = particle_name
-                            
-            particle_config = self.config['Input'][particle_name]
-
-            # Config options for true are : 'y', 'yes', 'Yes'
-            if particle_config['Static'] in ['y', 'yes', 'Yes']:
-                particle['Static'] = True
-            else:
-                particle['Static'] = False
-            
+        for particle_name, particle_config in self.particle_configs.items():
             # Every cell must at least contain a spot file that contains the centroid 
             # regardless of the analysis type
             track_path = pathlib.Path(path, particle_config['TrackFile'])
-            if not track_path.is_file():
+            if particle_config['TrackFile'] not in found_files and not track_path.is_file():
                 raise InvalidInputError(particle_config['TrackFile'])
-            particle['TrackFile'] = track_path
 
             # Cells can have either a mask or a particle raduis (no mask)
+            mask_path = ''
+            radius = 0.0
             if particle_config['MaskFile']:
                 mask_path = pathlib.Path(path, particle_config['MaskFile'])
-                if not mask_path.is_file():
+                if particle_config['MaskFile'] not in found_files and not mask_path.is_file():
                     raise InvalidInputError(particle_config['MaskFile'])
-                particle['MaskFile'] = mask_path
             else:
-                particle['Radius'] = particle_config['Radius']
-            particles.append(particle)
+                radius = particle_config['Radius']
+
+            # Particle dictionary for DCTracker module
+            # Config options for true are : 'y', 'yes', 'Yes'
+            particles.append({
+                'Name': particle_name,
+                'TrackFile': track_path,
+                'MaskFile': mask_path, # Optional
+                'Radius': radius, # Optional but required if no mask
+                'Static': particle_config['Static'].strip().lower() in TRUE_OPTIONS,
+            })
         
         return particles
         
@@ -323,10 +399,18 @@ class Runner():
         # Check if the output directory exists and is writable
         # This is done to avoid running the computation if the output cannot be written
         # If the output directory exist, make sure it's empty and writable
-        if self.output_dir.exists():
-            if self.output_dir.is_dir(): 
+        # The output path is stat once and its type is read from the result
+        try:
+            output_stat = self.output_dir.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            output_stat = None
+
+        if output_stat is not None:
+            if stat.S_ISDIR(output_stat.st_mode): 
                 if os.access(self.output_dir, os.W_OK):
-                    if len(list(self.output_dir.glob('*'))) > 0:
+                    with os.scandir(self.output_dir) as it:
+                        is_empty = next(it, None) is None
+                    if not is_empty:
                         raise HaltException("Output path points to an existing non-empty directory.")
                 else:
                     raise HaltException("Output path points to a non-writable directory.")
@@ -334,7 +418,7 @@ class Runner():
                 raise HaltException("Output path points to an existing file.")
         # Make sure that the parent directory is writable
         else:
-            parent_dir = pathlib.Path(self.output_dir).parents[0]
+            parent_dir = self.output_dir.parent
             if not os.access(parent_dir, os.W_OK):
                 raise HaltException("Output path points to a non-writable directory.")
 
@@ -362,7 +446,7 @@ class CLIRunner(Runner):
         try:
             super().main()
         except HaltException as e:
-            self.logger.error(e, extra={'context': self.CONTEXT})
+            self.logger.error(e)
             sys.exit(1)
         
 
@@ -457,6 +541,14 @@ class GUIRunner(Runner):
         logging.getLogger().setLevel(logging.DEBUG)        
         self.textedit_logger.signal_logging.connect(self.insert_html)
 
+        # The log messages are buffered and inserted together about 30 times per second
+        # so a burst of messages does not redraw the console for every message
+        self.pending_html = []
+        self.log_timer = QtCore.QTimer()
+        self.log_timer.setInterval(33)
+        self.log_timer.timeout.connect(self.flush_html)
+        self.log_timer.start()
+
         self.worker = Worker(self.main, ())
         self.worker.finished.connect(self.restore_ui)
         self.worker.terminate()
@@ -491,10 +583,10 @@ class GUIRunner(Runner):
         try:
             super().main()
         except HaltException as e:
-            self.logger.critical(e, extra={'context': self.CONTEXT})
+            self.logger.critical(e)
         except Exception as e:
-            self.logger.critical("An unhandled except occured during CoPixie run. Please consider reporting the issue to help CoPixie development." , extra={'context': self.CONTEXT})
-            self.logger.critical(e, exc_info=True, extra={'context': self.CONTEXT})
+            self.logger.critical("An unhandled except occured during CoPixie run. Please consider reporting the issue to help CoPixie development.")
+            self.logger.critical(e, exc_info=True)
 
 
     # Button signals handling functions 
@@ -517,6 +609,7 @@ class GUIRunner(Runner):
 
 
     def run_main(self):
+        self.pending_html.clear()
         self.textedit_logger.widget.clear()
         self.run_button.setEnabled(False)
         self.worker.start()
@@ -527,9 +620,22 @@ class GUIRunner(Runner):
 
 
     def insert_html(self, msg):
-        self.textedit_logger.widget.insertHtml(msg)
-        self.textedit_logger.widget.insertHtml("<br>")
-        self.textedit_logger.widget.ensureCursorVisible()
+        self.pending_html.append(msg)
+
+
+    def flush_html(self):
+        if not self.pending_html:
+            return
+
+        # Insert every buffered message with the updates disabled, the console is redrawn once
+        widget = self.textedit_logger.widget
+        widget.setUpdatesEnabled(False)
+        for msg in self.pending_html:
+            widget.insertHtml(msg)
+            widget.insertHtml("<br>")
+        widget.setUpdatesEnabled(True)
+        self.pending_html.clear()
+        widget.ensureCursorVisible()
 
 
 
@@ -550,10 +656,12 @@ else:
             formatter = ColoredFormatter('%(asctime)s  [%(context)s]  %(levelname)s    %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
             self.setFormatter(formatter)
 
+            # The converter is created once and reused for every record
+            self.converter = Ansi2HTMLConverter(dark_bg=False)
+
         def emit(self, record):
             msg = self.format(record)
-            conv = Ansi2HTMLConverter(dark_bg=False)
-            html = conv.convert(msg)
+            html = self.converter.convert(msg)
             self.signal_logging.emit(html)
 
             
@@ -17,6 +17,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import multiprocessing
+import os
 import json
 import subprocess
 import logging 
@@ -36,64 +37,98 @@ class CalledProcessError(RuntimeError):
     """Raise if the post-processing process exits with a non-zero error code""" 
 
 
+def run_dctracker(params):
+    """
+    Run the complete analysis pipeline : DCTracker, Colocalize and write the cell JSON file
+    This is a module function so only the cell parameters are sent to the pool workers (not the pipeline)
+
+    Arguments:
+        params: DCTracker module parameters
+
+    Return:
+        str: Warning message if the cell could not be analysed, None otherwise
+    """
+
+    try:
+        DCTracker(params)
+        Colocalize(params)
+        write_json(params)
+    except InvalidCentroidError:
+        return "Mask and tracking does not match for cell \"{}\".".format(params[0]['Label'])
+
+
+def estimate_cost(params):
+    """
+    Estimate the processing cost of a cell from the size of its track and mask files
+
+    Arguments:
+        params: DCTracker module parameters
+
+    Return:
+        int: Total size of the track and mask files (in bytes)
+    """
+    cost = 0
+    for particle in params[1:]:
+        for path in (particle['TrackFile'], particle['MaskFile']):
+            try:
+                cost += os.path.getsize(path) if path else 0
+            except OSError:
+                pass
+    return cost
+
+
+def write_json(params):
+    """Write the cell information in JSON format in the output directory"""
+
+    # Generate a dict that contains the JSON object
+    description = params[0]
+    metadata = {
+        'Condition': description['Condition'],
+        'Replicate': description['Replicate'][0], 
+        'Label': description['Label'],
+        'PixelSize': description['PixelSize'],
+        'FrameInterval': description['FrameInterval']
+    }
+
+    # Write the metadata
+    full_json_file_path = pathlib.Path(description['Output'], 'Metadata.json')
+    with open(full_json_file_path, "w") as h:
+        json.dump(metadata, h, indent = 4)
+
+
 class Pipeline():
     """
     This class runs DCTracker analysis pipeline
     """
 
     def __init__(self, params, postprocessing=[]):
-        # Start the logger
-        self.logger = logging.getLogger()
+        # Start the logger (the context is added to every record by the adapter)
         self.CONTEXT = "Pipeline"
+        self.logger = logging.LoggerAdapter(logging.getLogger(), {'context': self.CONTEXT})
 
         # Run the pipeline in multiprocessing
-        self.logger.info("Starting CoPixie pipeline (CoPixie+Colocalize)", extra={'context': self.CONTEXT})
-        with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-            pool.map(self.run_dctracker, params)
+        self.logger.info("Starting CoPixie pipeline (CoPixie+Colocalize)")
+        # The cells are independent, so they are processed as soon as a worker is available (in any order)
+        # The largest cells (track and mask files) are started first so a long cell does not finish alone at the end of the run
+        # The cells are sent to the workers in small batches to limit the communication overhead
+        # Workers are replaced periodically to release the memory kept by pandas
+        process_count = multiprocessing.cpu_count()
+        tasks = sorted(params, key=estimate_cost, reverse=True)
+        chunksize = min(4, max(1, len(tasks) // (process_count*4)))
+        with multiprocessing.Pool(processes=process_count, maxtasksperchild=32) as pool:
+            # The workers return the warning message of the cells that could not be analysed, which are logged here
+            for warning in pool.imap_unordered(run_dctracker, tasks, chunksize=chunksize):
+                if warning:
+                    self.logger.warning(warning)
 
         # Run the post-processing tasks
         if postprocessing:
-            self.logger.info("Running post-processing tasks", extra={'context': self.CONTEXT})
+            self.logger.info("Running post-processing tasks")
             output_dir = postprocessing[0]
             postprocessing_cmd = postprocessing[1]
             self.run_postprocessing(params, output_dir, postprocessing_cmd)
 
 
-    def run_dctracker(self, params):
-        """
-        Run the complete analysis pipeline : DCTracker, Colocalize and write the cell JSON file
-
-        Arguments:
-            params: DCTracker module parameters
-        """
-
-        try:
-            DCTracker(params)
-            Colocalize(params)
-            self.write_json(params)
-        except InvalidCentroidError:
-            self.logger.warning("Mask and tracking does not match for cell \"{}\".".format(params[0]['Label']), extra={'context': self.CONTEXT})
-
-
-    def write_json(self, params):
-        """Write the cell information in JSON format in the output directory"""
-
-        # Generate a dict that contains the JSON object
-        description = params[0]
-        metadata = {
-            'Condition': description['Condition'],
-            'Replicate': description['Replicate'][0], 
-            'Label': description['Label'],
-            'PixelSize': description['PixelSize'],
-            'FrameInterval': description['FrameInterval']
-        }
-
-        # Write the metadata
-        full_json_file_path = pathlib.Path(description['Output'], 'Metadata.json')
-        with open(full_json_file_path, "w") as h:
-            json.dump(metadata, h, indent = 4)
-
-
     def run_postprocessing(self, params, output_dir, cmd):
         """
         Run the post-processing command on DCTracker output directory
@@ -0,0 +1,76 @@
+import unittest
+
+# Add project directory to sys.path in order to make the project file easily visible
+# as discussed in https://stackoverflow.com/q/4761041
+# Must be before the project import statements
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "..")
+
+import numpy as np
+import pandas as pd
+
+from dctracker import accelerated
+
+class TestAccelerated(unittest.TestCase):
+
+    def reference_keep_mask(self, df):
+        """Per frame uniqueness filter as implemented with pandas before the kernel"""
+        frames = []
+        for k,g in df.groupby(by="FRAME"):
+            nan_mask = g.isna().any(axis=1)
+            unique_masks = []
+            for col in g.columns[1:]:
+                unique_mask = g[col].isin(g[col].value_counts()[g[col].value_counts()==1].index)
+                unique_masks.append(unique_mask)
+            keep = ~nan_mask | np.any(unique_masks, axis=0)
+            frames.append(keep.to_numpy())
+        return np.concatenate(frames)
+
+
+    def random_matrix(self, seed):
+        """Generate a random colocalisation matrix sorted by frame with missing particles"""
+        rng = np.random.default_rng(seed)
+        n = 200
+        df = pd.DataFrame({
+            'FRAME': rng.integers(0, 10, n),
+            'A': rng.integers(0, 8, n).astype(float),
+            'B': rng.integers(0, 8, n).astype(float),
+        })
+        df.loc[rng.random(n) < 0.3, 'A'] = np.nan
+        df.loc[rng.random(n) < 0.3, 'B'] = np.nan
+        return df.sort_values(by=['FRAME', 'A', 'B']).reset_index(drop=True)
+
+    ############################################################
+    #                  TESTS STARTS HERE                       #
+    ############################################################
+
+
+    def test_keep_mask_matches_pandas_filter(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                df = self.random_matrix(seed)
+                frames = df['FRAME'].to_numpy(dtype=np.int64)
+                ids = df[['A', 'B']].fillna(-1).to_numpy(dtype=np.int64)
+                np.testing.assert_array_equal(accelerated.keep_mask(frames, ids), self.reference_keep_mask(df))
+
+
+    def test_keep_mask_pandas_matches_kernel(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                df = self.random_matrix(seed)
+                frames = df['FRAME'].to_numpy(dtype=np.int64)
+                ids = df[['A', 'B']].fillna(-1).to_numpy(dtype=np.int64)
+                np.testing.assert_array_equal(accelerated.keep_mask_pandas(frames, ids), accelerated.keep_mask(frames, ids))
+
+
+    def test_keep_mask_keeps_complete_rows(self):
+        frames = np.array([0, 0], dtype=np.int64)
+        ids = np.array([[1, 2], [1, 2]], dtype=np.int64)
+        np.testing.assert_array_equal(accelerated.keep_mask(frames, ids), [True, True])
+
+
+    def test_keep_mask_drops_incomplete_rows_without_unique_id(self):
+        frames = np.array([0, 0, 1], dtype=np.int64)
+        ids = np.array([[1, 2], [1, -1], [1, -1]], dtype=np.int64)
+        np.testing.assert_array_equal(accelerated.keep_mask(frames, ids), [True, False, True])
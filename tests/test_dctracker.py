@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+import pathlib
+
+# Add project directory to sys.path in order to make the project file easily visible
+# as discussed in https://stackoverflow.com/q/4761041
+# Must be before the project import statements
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "..")
+
+import numpy as np
+import pandas as pd
+from skimage import io
+
+from dctracker.dctracker import DCTracker, InvalidCentroidError
+
+class TestDCTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_tracks(self, name, rows):
+        """Write a TrackMate file with the given (TRACK_ID, X, Y, FRAME) rows"""
+        path = self.dir / (name + '.csv')
+        with open(path, 'w') as f:
+            f.write('LABEL,ID,TRACK_ID,QUALITY,POSITION_X,POSITION_Y,POSITION_Z,POSITION_T,FRAME\n')
+            for i, (track_id, x, y, frame) in enumerate(rows):
+                f.write('ID{0},{0},{1},1.0,{2},{3},0.0,{4}.0,{4}\n'.format(i, track_id, x, y, frame))
+        return path
+
+    def write_mask(self, name, mask):
+        path = self.dir / (name + '_mask.tif')
+        io.imsave(path, mask, check_contrast=False)
+        return path
+
+    def particle(self, name, track_file, mask_file='', radius=0.0, static=False):
+        return {'Name': name, 'TrackFile': track_file, 'MaskFile': mask_file, 'Radius': radius, 'Static': static}
+
+    def run_dctracker(self, particles):
+        output = self.dir / 'output'
+        DCTracker([{'Output': output, 'PixelSize': 1.0}] + particles)
+        return pd.read_csv(output / 'DCTracker.csv', dtype='Int64')
+
+    ############################################################
+    #                  TESTS STARTS HERE                       #
+    ############################################################
+
+
+    def test_static_centroid_with_frames_after_the_movie(self):
+        moving = np.zeros((6, 10, 10), dtype=np.uint8)
+        moving[:, 2:5, 2:5] = 1
+        static = np.zeros((10, 10), dtype=np.uint8)
+        static[3:7, 3:7] = 1
+
+        df = self.run_dctracker([
+            self.particle('A', self.write_tracks('A', [(0, 3, 3, t) for t in range(6)]), self.write_mask('A', moving)),
+            self.particle('S', self.write_tracks('S', [(0, 4, 4, 0)]), self.write_mask('S', static), static=True),
+            self.particle('C', self.write_tracks('C', [(0, 4, 4, t) for t in range(9)]), radius=1.0, static=True),
+        ])
+
+        # The static mask is only broadcasted to the frames of the moving tracks
+        expected = pd.DataFrame({'FRAME': range(9), 'A': [0]*6 + [None]*3, 'S': [0]*6 + [None]*3, 'C': [0]*9}, dtype='Int64')
+        pd.testing.assert_frame_equal(df, expected)
+
+
+    def test_moving_particle_with_static_mask_is_invalid(self):
+        mask = np.zeros((10, 10), dtype=np.uint8)
+        mask[2:5, 2:5] = 1
+
+        with self.assertRaises(InvalidCentroidError):
+            self.run_dctracker([
+                self.particle('A', self.write_tracks('A', [(0, 3, 3, 0)]), self.write_mask('A', mask)),
+                self.particle('C', self.write_tracks('C', [(0, 3, 3, 0)]), radius=1.0),
+            ])
+
+
+    def test_static_particle_with_movie_mask_is_invalid(self):
+        mask = np.zeros((3, 10, 10), dtype=np.uint8)
+        mask[:, 2:5, 2:5] = 1
+
+        with self.assertRaises(InvalidCentroidError):
+            self.run_dctracker([
+                self.particle('C', self.write_tracks('C', [(0, 3, 3, t) for t in range(3)]), radius=1.0),
+                self.particle('S', self.write_tracks('S', [(0, 3, 3, 0)]), self.write_mask('S', mask), static=True),
+            ])
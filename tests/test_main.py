@@ -1,4 +1,5 @@
 import unittest
+import tempfile
 
 # Add project directory to sys.path in order to make the project file easily visible
 # as discussed in https://stackoverflow.com/q/4761041
@@ -10,4 +11,32 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "..")
 from dctracker import main 
 
 class TestConfig(unittest.TestCase):
-    pass 
\ No newline at end of file
+
+    def parse_metadata(self, content):
+        """Parse a metadata file with the given content"""
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False) as f:
+            f.write(content)
+        runner = main.Runner.__new__(main.Runner)
+        runner.metadata_file = f.name
+        try:
+            return runner.parse_metadata()
+        finally:
+            os.remove(f.name)
+
+    ############################################################
+    #                  TESTS STARTS HERE                       #
+    ############################################################
+
+
+    def test_parse_metadata_groups_replicates_by_condition(self):
+        metadata = self.parse_metadata("# Condition,Replicate,Path\nA,1,/a/1\n\n  # A,3,/a/3\nA,2,/a/2\nB,1,/b/1\n")
+        self.assertEqual(metadata, {'A': [['1', '/a/1'], ['2', '/a/2']], 'B': [['1', '/b/1']]})
+
+
+    def test_parse_metadata_throws_exception_when_columns_missing(self):
+        with self.assertRaises(RuntimeError):
+            self.parse_metadata("A,1\n") 
+
+    def test_parse_metadata_reads_quoted_path(self):
+        metadata = self.parse_metadata("A,1,\"/a/1,2\"\n")
+        self.assertEqual(metadata, {'A': [['1', '/a/1,2']]})